@@ -1,6 +1,6 @@
-import random
+import numpy as np
 
-from genetics import Genotype
+from genetics import Gene, Genotype, rng
 from network import Network
 
 
@@ -10,6 +10,10 @@ class Entity:
 
     genotype - genotype encoding network structure
     fitness - fitness score of network
+    network - decoded network, cached until genotype changes
+    markers - sorted array of genes historical markers, computed on first comparison
+    marker_weights - array of genes weights in markers order
+    specie - specie which accepted the entity or, before insertion, specie of its parents
     """
 
     def __init__(self, input_num, output_num):
@@ -21,16 +25,54 @@ class Entity:
         """
         self.genotype = Genotype(input_num, output_num) if input_num > 0 and output_num > 0 else None
         self.fitness = None
+        self.network = None
+        self.markers = None
+        self.marker_weights = None
+        self.specie = None
+
+    def __getstate__(self):
+        # cached network is rebuilt on demand and specie with all its entities stays in main process
+        state = self.__dict__.copy()
+        state['network'] = None
+        state['specie'] = None
+
+        return state
 
     def create_network(self):
         """
-        Decodes genotype to neural network
+        Decodes genotype to neural network, network is decoded once and reused with cleared state
 
         :return: Network
         """
-        return Network(self.genotype)
+        if self.network is None:
+            self.network = Network(self.genotype)
+        else:
+            self.network.reset()
+
+        return self.network
+
+    def get_markers(self):
+        """
+        Returns historical markers of genes sorted ascending, markers are computed once
 
-    def mate(self, entity):
+        :return: tuple
+            Array of markers and array of weights in the same order
+        """
+        if self.markers is None:
+            genotype = self.genotype
+            conn_to_ids = Gene.conn_to_ids
+
+            # first innovation number of connection, ids added when connection is created again are higher
+            markers = np.fromiter((min(conn_to_ids[c]) for c in genotype.connections), dtype=np.int64,
+                                  count=len(genotype.connections))
+            order = np.argsort(markers)
+
+            self.markers = markers[order]
+            self.marker_weights = genotype.weights[order]
+
+        return self.markers, self.marker_weights
+
+    def mate(self, entity, mutation=Genotype.mutate):
         """
         Creates new entity using crossover function
 
@@ -38,6 +80,8 @@ class Entity:
 
         :param entity: Entity
             Second parent for mating
+        :param mutation: callable, optional
+            Mutation applied to child genotype, mutation with default rates by default
         :return: Entity
             Child entity created from crossover
         """
@@ -46,21 +90,25 @@ class Entity:
         genotype2 = entity.genotype if self.fitness > entity.fitness else self.genotype
 
         # extracting matching genes
-        matched_genes = set(genotype1.genes).intersection(set(genotype2.genes))
+        matched_genes = genotype1.gene_keys & genotype2.gene_keys
+        matched_num = len(matched_genes)
 
         child_gen = genotype1.copy()
 
-        # genes replacement
-        for mg in matched_genes:
-            rand = random.random()
-            if rand < .5:
-                child_gen.genes[mg].weight = genotype2.genes[mg].weight
+        # genes replacement, weights positions of matching genes in both genotypes
+        indices1 = np.fromiter((genotype1.genes[mg] for mg in matched_genes), dtype=np.intp, count=matched_num)
+        indices2 = np.fromiter((genotype2.genes[mg] for mg in matched_genes), dtype=np.intp, count=matched_num)
+
+        replaced = rng.random(matched_num) < .5
+        child_gen.weights[indices1[replaced]] = genotype2.weights[indices2[replaced]]
 
         # apply mutation
-        child_gen.mutate()
+        mutation(child_gen)
 
         child = Entity(0, 0)
         child.genotype = child_gen
+        # parents are from the same specie
+        child.specie = self.specie
 
         return child
 
@@ -78,15 +126,27 @@ class Entity:
             List of input vectors
         :param input_type: str, optional
             Network input type
-        :param output: list
-            List of expected output vectors
+        :param output: list or np.ndarray
+            List of expected output vectors or array of them stacked by rows
         """
-        self.fitness = 0
-        network = Network(self.genotype)
+        network = self.create_network()
 
         net_out = network.compute(data, input_type)
-        for y, y_hat in zip(net_out, output):
-            loss = (y - y_hat) ** 2
-            self.fitness -= loss.item()
+        self.score(net_out, output)
+
+    def score(self, net_out, output):
+        """
+        Calculates entity fitness score base on network outputs and expected outputs
+
+        :param net_out: list
+            List of network output vectors
+        :param output: list or np.ndarray
+            List of expected output vectors or array of them stacked by rows
+        """
+        # squared error computed in place of stacked outputs
+        error = np.array(net_out)
+        np.subtract(error, output, out=error)
+        np.square(error, out=error)
+        loss = error.sum(axis=1)
 
-        self.fitness /= len(data)
+        self.fitness = -float(np.mean(loss))
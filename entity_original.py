@@ -12,6 +12,11 @@ class Entity:
 
     genotype - genotype encoding network structure
     fitness - fitness score of network
+    network - decoded network, cached until genotype changes
+    network_genotype - genotype from which network was decoded
+    network_version - version of genotype from which network was decoded
+    markers - sorted array of genes historical markers, computed on first comparison
+    marker_weights - array of genes weights in markers order
     """
 
     def __init__(self, input_num, output_num):
@@ -23,14 +28,44 @@ class Entity:
         """
         self.genotype = Genotype(input_num, output_num) if input_num > 0 and output_num > 0 else None
         self.fitness = None
+        self.network = None
+        self.network_genotype = None
+        self.network_version = None
+        self.markers = None
+        self.marker_weights = None
 
     def create_network(self):
         """
-        Decodes genotype to neural network
+        Decodes genotype to neural network, network is decoded again when genotype changes or is replaced
 
         :return: Network
         """
-        return Network(self.genotype)
+        genotype = self.genotype
+        if self.network is None or self.network_genotype is not genotype or self.network_version != genotype.version:
+            self.network = Network(genotype)
+            self.network_genotype = genotype
+            self.network_version = genotype.version
+        else:
+            self.network.reset()
+
+        return self.network
+
+    def get_markers(self):
+        """
+        Returns historical markers of genes sorted ascending, markers are computed once
+
+        :return: tuple
+            Array of markers and array of weights in the same order
+        """
+        if self.markers is None:
+            markers, connections = self.genotype.get_markers()
+            genes = self.genotype.genes
+
+            self.markers = markers
+            self.marker_weights = np.fromiter((genes[c].weight for c in connections), dtype=np.float64,
+                                              count=len(connections))
+
+        return self.markers, self.marker_weights
 
     def mate(self, entity):
         """
@@ -47,24 +82,28 @@ class Entity:
         genotype1 = self.genotype if self.fitness > entity.fitness else entity.genotype
         genotype2 = entity.genotype if self.fitness > entity.fitness else self.genotype
 
-        # extracting matching genes
-        matched_genes = set(genotype1.genes).intersection(set(genotype2.genes))
-
         child_gen = genotype1.copy()
 
-        # genes replacement
-        for mg in matched_genes:
-            if not genotype1.genes[mg].active or not genotype2.genes[mg].active:
-                rand = random.random()
-                if rand < .75:
-                    child_gen.genes[mg].active = False
-                else:
-                    child_gen.genes[mg].active = True
+        # lookups hoisted out of the loop
+        genes2 = genotype2.genes
+        child_genes = child_gen.genes
+        rand = random.random
+
+        # genes replacement, matching genes are found in one pass over second parent genes,
+        # one random bit per gene decides about weight replacement
+        replacement_bits = random.getrandbits(len(genes2))
+        for i, (mg, gene2) in enumerate(genes2.items()):
+            # child gene is a copy of gene from genotype1
+            child_gene = child_genes.get(mg)
+            if child_gene is None:
+                continue
 
-            if child_gen.genes[mg].active:
-                rand = random.random()
-                if rand < .5:
-                    child_gen.genes[mg].weight = genotype2.genes[mg].weight
+            if not child_gene.active or not gene2.active:
+                child_gene.active = rand() >= .75
+
+            if child_gene.active:
+                if replacement_bits >> i & 1:
+                    child_gene.weight = gene2.weight
 
         # apply mutation
         child_gen.mutate()
@@ -86,19 +125,31 @@ class Entity:
 
         :param data: list
             List of input vectors
-        :param output: list
-            List of expected output vectors
+        :param output: list or np.ndarray
+            List of expected output vectors or array of them stacked by rows
         :param input_type: str, optional
             Network input type
         :param output_type: str, optional
             Network output type
         """
-        self.fitness = 0
-        network = Network(self.genotype)
+        network = self.create_network()
 
         net_out = network.compute(data, input_type, output_type)
-        for y, y_hat in zip(net_out, output):
-            loss = np.sum((y - y_hat) ** 2)
-            self.fitness -= loss
+        self.score(net_out, output)
+
+    def score(self, net_out, output):
+        """
+        Calculates entity fitness score base on network outputs and expected outputs
+
+        :param net_out: list
+            List of network output vectors
+        :param output: list or np.ndarray
+            List of expected output vectors or array of them stacked by rows
+        """
+        # squared error computed in place of stacked outputs
+        error = np.array(net_out)
+        np.subtract(error, output, out=error)
+        np.square(error, out=error)
+        loss = error.sum(axis=1)
 
-        self.fitness /= len(data)
+        self.fitness = -float(np.mean(loss))
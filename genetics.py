@@ -1,58 +1,106 @@
 import random
 
 import networkx as nx
+import numpy as np
 from matplotlib import pyplot as plt
 
+# generator used for batch weight mutation and crossover
+rng = np.random.default_rng()
+
 
 class Gene:
     """
-    Gene representing connection between nodes
-
-    input_id - id of input node
-    output_id - id of output node
-    weight - weight of connection
-    active - indicator if the gene is active
+    Global genetics of population, genes are stored in genotype arrays
 
-    genetics - static, maps gene id to input, output node tuple and other way around
+    conn_to_ids - static, maps input, output node tuple to set of gene ids
+    id_to_conn - static, maps gene id to input, output node tuple
     innovation - static, innovation number for marking new genes
-
-    When the weight is not given, random between -2 and 2 will be picked
     """
 
-    genetics = dict()
+    conn_to_ids = dict()
+    id_to_conn = dict()
     innovation = 0
 
-    def __init__(self, gene_id, weight=None):
+
+class RandomSet:
+    """
+    Set of elements with random choice in constant time
+
+    items - list of elements
+    positions - dictionary of elements positions in list | element: position
+    """
+
+    def __init__(self, items=()):
         """
-        :param gene_id: int
-            Id of the gene
-        :param weight: double, optional
-            Weight of connection
+        :param items: iterable, optional
+            Unique initial elements
         """
-        self.gene_id = gene_id
-        self.weight = weight if weight is not None else random.random() - .5
+        self.items = list(items)
+        self.positions = {e: i for i, e in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, element):
+        return element in self.positions
+
+    def __iter__(self):
+        return iter(self.items)
 
     def copy(self):
         """
-        Creates a copy of gene
+        Creates a copy of set
 
-        :return: Gene
+        :return: RandomSet
         """
-        cp = Gene(self.gene_id, self.weight)
+        cp = RandomSet()
+
+        cp.items = self.items.copy()
+        cp.positions = self.positions.copy()
 
         return cp
 
-    def randomize(self):
+    def add(self, element):
         """
-        Randomizes connection's weight
+        Adds element if it isn't in set
+
+        :param element: hashable
+            New element
         """
-        self.weight = random.random() * 4 - 2
+        if element not in self.positions:
+            self.positions[element] = len(self.items)
+            self.items.append(element)
 
-    def random_shift(self):
+    def remove(self, element):
         """
-        Shifts weight by random value
+        Removes element, last element in list takes its position
+
+        :param element: hashable
+            Removed element
+        """
+        position = self.positions.pop(element)
+        last = self.items.pop()
+        if last != element:
+            self.items[position] = last
+            self.positions[last] = position
+
+    def discard(self, element):
         """
-        self.weight += (random.random() * 4 - 2)
+        Removes element if it is in set
+
+        :param element: hashable
+            Removed element
+        """
+        if element in self.positions:
+            self.remove(element)
+
+    def choice(self):
+        """
+        Returns random element
+
+        :return: hashable
+        """
+        return self.items[random.randrange(len(self.items))]
 
 
 class Genotype:
@@ -62,8 +110,13 @@ class Genotype:
     input_nodes - set of input layer nodes ids
     output_nodes - set of output layer nodes ids
     hidden_nodes - set of hidden layers nodes ids
-    genes - dictionary of genes | (in,out): gene
-    routes - dictionary of aviable connections for given node | id: [id1, id2, ...]
+    genes - dictionary of genes positions in arrays | (in,out): index
+    connections - list of genes connections, same order as arrays | [(in,out), ...]
+    weights - array of connections weights, single precision is enough for noisy mutation
+    gene_ids - array of genes ids
+    gene_keys - frozenset of genes connections, cached for fast comparison between genotypes
+    routes - dictionary of aviable connections for given node | id: RandomSet(id1, id2, ...)
+    open_nodes - set of nodes with at least one aviable connection
     """
 
     def __init__(self, input_num, output_num):
@@ -77,7 +130,14 @@ class Genotype:
         self.output_nodes = set(range(input_num, input_num + output_num))
         self.hidden_nodes = set()
         self.genes = dict()
-        self.routes = {b: {e for e in self.output_nodes} for b in self.input_nodes}
+        self.gene_keys = frozenset()
+        self.connections = []
+        self.weights = np.empty(0, dtype=np.float32)
+        self.gene_ids = np.empty(0, dtype=np.int64)
+        self.routes = dict()
+        self.open_nodes = RandomSet()
+        for node in self.input_nodes:
+            self.set_routes(node, self.output_nodes)
 
     def copy(self):
         """
@@ -90,11 +150,59 @@ class Genotype:
         cp.input_nodes = self.input_nodes.copy()
         cp.output_nodes = self.output_nodes.copy()
         cp.hidden_nodes = self.hidden_nodes.copy()
-        cp.genes = {con: gen.copy() for con, gen in self.genes.items()}
-        cp.routes = {n: s.copy() for n, s in self.routes.items()}
+        cp.genes = self.genes.copy()
+        cp.connections = self.connections.copy()
+        cp.weights = self.weights.copy()
+        cp.gene_ids = self.gene_ids.copy()
+        cp.gene_keys = self.gene_keys
+        cp.routes = {n: r.copy() for n, r in self.routes.items()}
+        cp.open_nodes = self.open_nodes.copy()
 
         return cp
 
+    def set_routes(self, node, out_nodes):
+        """
+        Replaces aviable connections of node
+
+        :param node: int
+            Input node of connections
+        :param out_nodes: iterable
+            Aviable output nodes
+        """
+        self.routes[node] = RandomSet(out_nodes)
+
+        if len(self.routes[node]) > 0:
+            self.open_nodes.add(node)
+        else:
+            self.open_nodes.discard(node)
+
+    def add_route(self, in_node, out_node):
+        """
+        Marks connection between nodes as aviable
+
+        :param in_node: int
+            Input node of connection
+        :param out_node: int
+            Output node of connection
+        """
+        self.routes[in_node].add(out_node)
+        self.open_nodes.add(in_node)
+
+    def remove_route(self, in_node, out_node):
+        """
+        Marks connection between nodes as unaviable
+
+        :param in_node: int
+            Input node of connection
+        :param out_node: int
+            Output node of connection
+        """
+        routes = self.routes[in_node]
+        routes.remove(out_node)
+
+        if len(routes) == 0:
+            self.open_nodes.remove(in_node)
+
     def insert_gene(self, connection, weight=None):
         """
         Creates new gen, inserts it into genome and manages global genetics
@@ -104,59 +212,67 @@ class Genotype:
         :param connection: tuple
             Connected nodes (in, out)
         """
-        # genetics - dictionary mapping id to connection (in,out) and connection to set of ids
-        genetics = Gene.genetics
+        # global genetics bound to locals, innovation is written back after insertion
+        # dictionary mapping connection (in,out) to set of ids
+        conn_to_ids = Gene.conn_to_ids
+        id_to_conn = Gene.id_to_conn
+        innovation = Gene.innovation
 
-        if connection in genetics:
+        if connection in conn_to_ids:
             # connection between these nodes exists
 
             # old connections are transformed into hidden nodes, therefore first element in difference
             # between ids and hidden nodes ids will be the next connection in order
             # (sets are ordered, innovation is always incremented)
             # if difference is empty, nowhere before existed n connection between these nodes and will be added
-            possible_ids = genetics[connection]
+            possible_ids = conn_to_ids[connection]
             aviable_ids = possible_ids.difference(self.hidden_nodes)
 
             if len(aviable_ids) == 0:
-                new_id = Gene.innovation
-                Gene.innovation += 1
+                new_id = innovation
+                innovation += 1
 
-                genetics[connection].add(new_id)
-                genetics[new_id] = connection
+                possible_ids.add(new_id)
+                id_to_conn[new_id] = connection
             else:
                 new_id = next(iter(aviable_ids))
 
         else:
             # create new gene with innovation number
-            new_id = Gene.innovation
-            Gene.innovation += 1
+            new_id = innovation
+            innovation += 1
+
+            conn_to_ids[connection] = {new_id}
+            id_to_conn[new_id] = connection
 
-            genetics[connection] = {new_id}
-            genetics[new_id] = connection
+        Gene.innovation = innovation
 
         # remove output node from input node aviable connections
         in_node, out_node = connection
-        self.routes[in_node].remove(out_node)
+        self.remove_route(in_node, out_node)
 
-        # insert new connection gene
-        gene = Gene(new_id, weight)
-        self.genes[connection] = gene
+        # insert new connection gene at the end of arrays
+        weight = weight if weight is not None else random.random() - .5
+
+        self.genes[connection] = len(self.connections)
+        self.gene_keys = self.gene_keys.union((connection,))
+        self.connections.append(connection)
+        self.weights = np.append(self.weights, np.float32(weight))
+        self.gene_ids = np.append(self.gene_ids, new_id)
 
     def add_connection(self):
         """
         Creates new connection in network
         """
         # pick input node
-        in_nodes = [n for n in self.routes if len(self.routes[n]) > 0]
-        if len(in_nodes) == 0:
+        if len(self.open_nodes) == 0:
             # network is fully connected
             return
 
-        in_node = random.choice(in_nodes)
+        in_node = self.open_nodes.choice()
 
         # pick output node
-        out_nodes = self.routes[in_node]
-        out_node = random.choice(list(out_nodes))
+        out_node = self.routes[in_node].choice()
 
         key = (in_node, out_node)
         self.insert_gene(key)
@@ -168,20 +284,20 @@ class Genotype:
         Split gene is deleted and creates node with same id
         """
         # pick random connection
-        connections = list(self.genes)
+        connections = self.connections
         if len(connections) == 0:
             # there are no connections
             return
 
-        conn = random.choice(connections)
+        conn = connections[random.randrange(len(connections))]
 
-        gene = self.genes[conn]
+        index = self.genes[conn]
 
-        gene_id = gene.gene_id
-        conn_weight = gene.weight
+        gene_id = int(self.gene_ids[index])
+        conn_weight = float(self.weights[index])
 
         # remove transformed gene
-        del self.genes[conn]
+        self.remove_gene(conn)
 
         # creating two new connections
         in_node, out_node = conn
@@ -196,19 +312,41 @@ class Genotype:
         key2 = (new_in2, new_out2)
 
         # restore route
-        self.routes[in_node].add(out_node)
+        self.add_route(in_node, out_node)
         # add new node to routes
         for key in self.routes:
-            self.routes[key].add(gene_id)
+            self.add_route(key, gene_id)
         # create routes for new node
-        self.routes[gene_id] = {h for h in self.hidden_nodes}
-        self.routes[gene_id].update({o for o in self.output_nodes})
+        self.set_routes(gene_id, self.hidden_nodes | self.output_nodes)
 
         self.insert_gene(key1, weight=1)
         self.insert_gene(key2, weight=conn_weight)
 
         self.hidden_nodes.add(gene_id)
 
+    def remove_gene(self, connection):
+        """
+        Removes gene from genome, last gene in arrays takes its position
+
+        :param connection: tuple
+            Connected nodes (in, out)
+        """
+        index = self.genes.pop(connection)
+        self.gene_keys = self.gene_keys.difference((connection,))
+        last = len(self.connections) - 1
+
+        if index != last:
+            last_conn = self.connections[last]
+
+            self.connections[index] = last_conn
+            self.weights[index] = self.weights[last]
+            self.gene_ids[index] = self.gene_ids[last]
+            self.genes[last_conn] = index
+
+        self.connections.pop()
+        self.weights = self.weights[:last]
+        self.gene_ids = self.gene_ids[:last]
+
     def mutate(self, weight_rate=.8, connection_rate=.05, node_rate=.03):
         """
         Mutates genotype with x probability for structural mutation and 1-x for weight mutation
@@ -224,14 +362,14 @@ class Genotype:
         # weight mutation
         rand = random.random()
         if rand < weight_rate:
-            for conn in self.genes:
-                rand = random.random()
-                if rand < .9:
-                    # shift of weight
-                    self.genes[conn].random_shift()
-                else:
-                    # randomization
-                    self.genes[conn].randomize()
+            genes_num = len(self.weights)
+
+            # 90% of weights are shifted by random value, the rest is randomized
+            values = rng.random(genes_num, dtype=np.float32) * 4 - 2
+            shifted = rng.random(genes_num) < .9
+            values[shifted] += self.weights[shifted]
+
+            self.weights = values
 
         # new connection mutation
         rand = random.random()
@@ -255,7 +393,8 @@ class Genotype:
         g.add_nodes_from(self.input_nodes)
         g.add_nodes_from(self.output_nodes)
         g.add_nodes_from(self.hidden_nodes)
-        g.add_weighted_edges_from([(b, e, round(g.weight, 2)) for (b, e), g in self.genes.items()])
+        weights = self.weights.tolist()
+        g.add_weighted_edges_from([(b, e, round(weights[i], 2)) for (b, e), i in self.genes.items()])
 
         pos = nx.shell_layout(g)
         labels = nx.get_edge_attributes(g, 'weight')
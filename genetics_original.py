@@ -1,6 +1,7 @@
 import random
 
 import networkx as nx
+import numpy as np
 from matplotlib import pyplot as plt
 
 
@@ -13,13 +14,15 @@ class Gene:
     weight - weight of connection
     active - indicator if the gene is active
 
-    genetics - static, maps gene id to input, output node tuple and other way around
+    conn_to_id - static, maps input, output node tuple to gene id
+    id_to_conn - static, maps gene id to input, output node tuple
     innovation - static, innovation number for marking new genes
 
     When the weight is not given, random between -2 and 2 will be picked
     """
 
-    genetics = dict()
+    conn_to_id = dict()
+    id_to_conn = dict()
     innovation = 0
 
     def __init__(self, gene_id, weight=None, active=True):
@@ -56,6 +59,87 @@ class Gene:
         self.weight += (random.random() - .5)
 
 
+class RandomSet:
+    """
+    Set of elements with random choice in constant time
+
+    items - list of elements
+    positions - dictionary of elements positions in list | element: position
+    """
+
+    def __init__(self, items=()):
+        """
+        :param items: iterable, optional
+            Unique initial elements
+        """
+        self.items = list(items)
+        self.positions = {e: i for i, e in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, element):
+        return element in self.positions
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def copy(self):
+        """
+        Creates a copy of set
+
+        :return: RandomSet
+        """
+        cp = RandomSet()
+
+        cp.items = self.items.copy()
+        cp.positions = self.positions.copy()
+
+        return cp
+
+    def add(self, element):
+        """
+        Adds element if it isn't in set
+
+        :param element: hashable
+            New element
+        """
+        if element not in self.positions:
+            self.positions[element] = len(self.items)
+            self.items.append(element)
+
+    def remove(self, element):
+        """
+        Removes element, last element in list takes its position
+
+        :param element: hashable
+            Removed element
+        """
+        position = self.positions.pop(element)
+        last = self.items.pop()
+        if last != element:
+            self.items[position] = last
+            self.positions[last] = position
+
+    def discard(self, element):
+        """
+        Removes element if it is in set
+
+        :param element: hashable
+            Removed element
+        """
+        if element in self.positions:
+            self.remove(element)
+
+    def choice(self):
+        """
+        Returns random element
+
+        :return: hashable
+        """
+        return self.items[random.randrange(len(self.items))]
+
+
 class Genotype:
     """
     Genotype encoding one network
@@ -64,7 +148,12 @@ class Genotype:
     output_nodes - set of output layer nodes ids
     hidden_nodes - set of hidden layers nodes ids
     genes - dictionary of genes | (in,out): gene
-    routes - dictionary of aviable connections for given node | id: [id1, id2, ...]
+    connections - list of genes connections in insertion order | [(in,out), ...]
+    markers - sorted array of genes ids, computed on demand and kept until new gene is inserted
+    marker_connections - list of genes connections in markers order
+    routes - dictionary of aviable connections for given node | id: RandomSet(id1, id2, ...)
+    open_nodes - set of nodes with at least one aviable connection
+    version - counter of genotype changes, network decoded from genotype is valid until it changes
     """
 
     def __init__(self, input_num, output_num):
@@ -78,7 +167,14 @@ class Genotype:
         self.output_nodes = set(range(input_num, input_num + output_num))
         self.hidden_nodes = set()
         self.genes = dict()
-        self.routes = {b: {e for e in self.output_nodes} for b in self.input_nodes}
+        self.connections = []
+        self.markers = None
+        self.marker_connections = None
+        self.routes = dict()
+        self.open_nodes = RandomSet()
+        self.version = 0
+        for node in self.input_nodes:
+            self.set_routes(node, self.output_nodes)
 
     def copy(self):
         """
@@ -92,10 +188,78 @@ class Genotype:
         cp.output_nodes = self.output_nodes.copy()
         cp.hidden_nodes = self.hidden_nodes.copy()
         cp.genes = {con: gen.copy() for con, gen in self.genes.items()}
-        cp.routes = {n: s.copy() for n, s in self.routes.items()}
+        cp.connections = self.connections.copy()
+        # topology is the same, markers are shared until one of genotypes changes it
+        cp.markers = self.markers
+        cp.marker_connections = self.marker_connections
+        cp.routes = {n: r.copy() for n, r in self.routes.items()}
+        cp.open_nodes = self.open_nodes.copy()
+        cp.version = self.version
 
         return cp
 
+    def get_markers(self):
+        """
+        Returns historical markers of genes sorted ascending with connections in the same order
+
+        :return: tuple
+            Array of markers and list of connections
+        """
+        if self.markers is None:
+            genes = self.genes
+
+            markers = np.fromiter((gene.gene_id for gene in genes.values()), dtype=np.int64, count=len(genes))
+            order = np.argsort(markers)
+            connections = list(genes)
+
+            self.markers = markers[order]
+            self.marker_connections = [connections[i] for i in order.tolist()]
+
+        return self.markers, self.marker_connections
+
+    def set_routes(self, node, out_nodes):
+        """
+        Replaces aviable connections of node
+
+        :param node: int
+            Input node of connections
+        :param out_nodes: iterable
+            Aviable output nodes
+        """
+        self.routes[node] = RandomSet(out_nodes)
+
+        if len(self.routes[node]) > 0:
+            self.open_nodes.add(node)
+        else:
+            self.open_nodes.discard(node)
+
+    def add_route(self, in_node, out_node):
+        """
+        Marks connection between nodes as aviable
+
+        :param in_node: int
+            Input node of connection
+        :param out_node: int
+            Output node of connection
+        """
+        self.routes[in_node].add(out_node)
+        self.open_nodes.add(in_node)
+
+    def remove_route(self, in_node, out_node):
+        """
+        Marks connection between nodes as unaviable
+
+        :param in_node: int
+            Input node of connection
+        :param out_node: int
+            Output node of connection
+        """
+        routes = self.routes[in_node]
+        routes.remove(out_node)
+
+        if len(routes) == 0:
+            self.open_nodes.remove(in_node)
+
     def insert_gene(self, connection, weight=None):
         """
         Creates new gen, inserts it into genome and manages global genetics
@@ -105,45 +269,43 @@ class Genotype:
         :param weight: double, optional
             Connection weight
         """
-        # genetics - dictionary mapping id to connection (in,out) and connection to id
-        genetics = Gene.genetics
-
-        if connection in genetics:
-            # connection between these nodes exists
-            # innovation id is extracted from dictionary
+        # dictionary mapping connection (in,out) to id, looked up once
+        conn_to_id = Gene.conn_to_id
+        new_id = conn_to_id.get(connection)
 
-            new_id = genetics[connection]
-        else:
+        if new_id is None:
             # create new gene with innovation number
             new_id = Gene.innovation
-            Gene.innovation += 1
+            Gene.innovation = new_id + 1
 
-            genetics[connection] = new_id
-            genetics[new_id] = connection
+            conn_to_id[connection] = new_id
+            Gene.id_to_conn[new_id] = connection
 
         # remove output node from input node aviable connections
         in_node, out_node = connection
-        self.routes[in_node].remove(out_node)
+        self.remove_route(in_node, out_node)
 
         # insert new connection gene
+        self.version += 1
         gene = Gene(new_id, weight)
         self.genes[connection] = gene
+        self.connections.append(connection)
+        self.markers = None
+        self.marker_connections = None
 
     def add_connection(self):
         """
         Creates new connection in network
         """
         # pick input node
-        in_nodes = [n for n in self.routes if len(self.routes[n]) > 0]
-        if len(in_nodes) == 0:
+        if len(self.open_nodes) == 0:
             # network is fully connected
             return
 
-        in_node = random.choice(in_nodes)
+        in_node = self.open_nodes.choice()
 
         # pick output node
-        out_nodes = self.routes[in_node]
-        out_node = random.choice(list(out_nodes))
+        out_node = self.routes[in_node].choice()
 
         connection = (in_node, out_node)
         self.insert_gene(connection)
@@ -155,12 +317,12 @@ class Genotype:
         Split gene is deleted and creates node with same id
         """
         # pick random connection
-        connections = list(self.genes)
+        connections = self.connections
         if len(connections) == 0:
             # there are no connections
             return
 
-        conn = random.choice(connections)
+        conn = connections[random.randrange(len(connections))]
 
         gene = self.genes[conn]
 
@@ -169,6 +331,7 @@ class Genotype:
         # deactivate split connection
         # TODO remake as gene method
         gene.active = False
+        self.version += 1
 
         # create two new connections
         in_node, out_node = conn
@@ -185,10 +348,9 @@ class Genotype:
 
         # add new node to routes
         for key in self.routes:
-            self.routes[key].add(new_node_id)
+            self.add_route(key, new_node_id)
         # create routes for new node
-        self.routes[new_node_id] = {h for h in self.hidden_nodes}
-        self.routes[new_node_id].update({o for o in self.output_nodes})
+        self.set_routes(new_node_id, self.hidden_nodes | self.output_nodes)
 
         # add new genes
         self.insert_gene(connection1, weight=1)
@@ -212,6 +374,7 @@ class Genotype:
         # weight mutation
         rand = random.random()
         if rand < weight_rate:
+            self.version += 1
             for conn in self.genes:
                 rand = random.random()
                 if rand < .9:
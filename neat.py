@@ -1,10 +1,50 @@
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import accumulate, repeat
 
+import numpy as np
 from matplotlib import pyplot as plt
 
 from entity import Entity
-from genetics import Gene
-from specie import Specie
+from genetics import Gene, Genotype
+from specie import Specie, test_entities
+
+
+# data set of worker process, sent once when the pool is started
+_worker_data = None
+_worker_output = None
+
+
+def _init_worker(data, output):
+    """
+    Stores data set in worker process
+
+    :param data: np.ndarray
+        Input vectors stacked by rows
+    :param output: np.ndarray
+        Expected output vectors stacked by rows
+    """
+    global _worker_data, _worker_output
+    _worker_data = data
+    _worker_output = output
+
+
+def _eval_entities(entities, input_type):
+    """
+    Calculates fitness of batch of entities on worker data set, executed in worker process
+
+    :param entities: list
+        Pickled copies of entities
+    :param input_type: str
+        Network input type
+    :return: list
+        Fitness scores of entities
+    """
+    test_entities(entities, _worker_data, _worker_output, input_type)
+
+    return [entity.fitness for entity in entities]
 
 
 class NEAT:
@@ -12,7 +52,8 @@ class NEAT:
     NeuroEvolution of Augmented Topologies algorithm
     """
 
-    def __init__(self, input_num, output_num, population=150, specie_acceptance=3, distance_params=(1, 1, .4)):
+    def __init__(self, input_num, output_num, population=150, specie_acceptance=3, distance_params=(1, 1, .4),
+                 mutation_rates=(.8, .05, .03), workers=None):
         """
         :param input_num: int
             Number of input layer nodes
@@ -24,14 +65,28 @@ class NEAT:
             Acceptance percentage of specie marker size to its difference upon inserting new entity
         :param distance_params: tuple
             Weights for specie distance formula
+        :param mutation_rates: tuple, optional
+            Probabilities of weights mutation, adding new connection and splitting connection with new node
+        :param workers: int, optional
+            Number of processes used for fitness evaluation, all cpu cores by default, 1 disables multiprocessing
         """
         self.input_num = input_num
         self.output_num = output_num
         self.population = population
         self.specie_acceptance = specie_acceptance
         self.distance_c1, self.distance_c2, self.distance_c3 = distance_params
+        # rates are bound once for the whole run
+        weight_rate, connection_rate, node_rate = mutation_rates
+        self.mutation = partial(Genotype.mutate, weight_rate=weight_rate, connection_rate=connection_rate,
+                                node_rate=node_rate)
+        self.workers = workers if workers is not None else os.cpu_count()
+        # worker processes are started on first use and kept with their data set
+        self.executor = None
+        self.executor_data = None
 
         self.species = []
+        # species of current generation which accepted the latest child of entities from given specie
+        self.successors = dict()
 
         self.error_value = []
 
@@ -73,23 +128,49 @@ class NEAT:
         :param entity: Entity
             New entity
         :param suggestion: Specie, optional
-            Suggested specie for new entity
+            Suggested specie for new entity, by default specie which accepted the latest child of entity's parents
         """
-        if suggestion is not None:
-            delta = suggestion.get_genetic_distance(entity, self.distance_c1, self.distance_c2, self.distance_c3)
+        if suggestion is None and entity.specie is not None:
+            # children of the same parents specie usually belong to the same specie
+            suggestion = self.successors.get(entity.specie)
+
+        # species with too different numbers of genes are rejected without comparing genes
+        c1, c2, c3 = self.distance_c1, self.distance_c2, self.distance_c3
+
+        if suggestion is not None and suggestion.get_distance_bound(entity, c1, c2) < self.specie_acceptance:
+            delta = suggestion.get_genetic_distance(entity, c1, c2, c3)
             if delta < self.specie_acceptance:
                 suggestion.entities.append(entity)
+                self.track_lineage(entity, suggestion)
                 return
 
         for specie in self.species:
-            delta = specie.get_genetic_distance(entity, self.distance_c1, self.distance_c2, self.distance_c3)
+            if specie.get_distance_bound(entity, c1, c2) >= self.specie_acceptance:
+                continue
+
+            delta = specie.get_genetic_distance(entity, c1, c2, c3)
 
             if delta < self.specie_acceptance:
                 specie.entities.append(entity)
+                self.track_lineage(entity, specie)
                 return
 
         new_specie = Specie(entity)
         self.species.append(new_specie)
+        self.track_lineage(entity, new_specie)
+
+    def track_lineage(self, entity, specie):
+        """
+        Remembers specie which accepted entity, it is suggested for next children of the same parents specie
+
+        :param entity: Entity
+            Inserted entity
+        :param specie: Specie
+            Specie which accepted entity
+        """
+        if entity.specie is not None:
+            self.successors[entity.specie] = specie
+        entity.specie = specie
 
     def show_best(self, data):
         """
@@ -115,7 +196,10 @@ class NEAT:
         for specie in self.species:
             specie.sort()
 
-        self.species.sort(key=lambda s: s.get_best_fitness(), reverse=True)
+        # species by fitness of their best entity, first in sorted scores
+        best_fitness = np.fromiter((s.fitnesses[0] for s in self.species), dtype=np.float64, count=len(self.species))
+        order = np.argsort(-best_fitness, kind='stable')
+        self.species = [self.species[i] for i in order.tolist()]
         self.error_value.append(-self.species[0].get_best_fitness())
 
     def next_generation(self):
@@ -125,10 +209,17 @@ class NEAT:
         # create new species pool and save old one
         old_species = self.species
         self.species = []
+        self.successors = dict()
 
         # calculate number of offspring base on shared fitness
-        total_shared_fitness = sum([s.shared_fitness for s in old_species])
-        offsprings = [round(s.shared_fitness / total_shared_fitness * self.population) for s in old_species]
+        shared_fitness = np.fromiter((s.shared_fitness for s in old_species), dtype=np.float64, count=len(old_species))
+        quotas = shared_fitness / shared_fitness.sum() * self.population
+
+        # largest remainder apportionment, remaining places go to species with the biggest fractional part
+        offsprings = np.floor(quotas).astype(int)
+        remaining = self.population - offsprings.sum()
+        offsprings[np.argsort(offsprings - quotas)[:remaining]] += 1
+        offsprings = offsprings.tolist()
 
         # pass best entity unchanged as first specie child
         offsprings[0] -= 1
@@ -136,11 +227,11 @@ class NEAT:
 
         # mate species to recreate population
         for specie, offspring in zip(old_species, offsprings):
-            mate_probabilities = list(reversed([i + 1 for i in range(len(specie.entities))]))
-            for i in range(offspring):
-                parent1, parent2 = random.choices(specie.entities, mate_probabilities, k=2)
-
-                child = parent1.mate(parent2)
+            # rank weights, best entity is the most probable, drawn for all children at once
+            cum_weights = list(accumulate(range(len(specie.entities), 0, -1)))
+            parents = random.choices(specie.entities, cum_weights=cum_weights, k=2 * max(offspring, 0))
+            for parent1, parent2 in zip(parents[::2], parents[1::2]):
+                child = parent1.mate(parent2, self.mutation)
                 self.insert_entity(child)
 
         # adapt acceptance delta
@@ -161,5 +252,58 @@ class NEAT:
         :param output: list
             List of expecting output vectors
         """
+        # input vectors and expected outputs are stacked once for all entities
+        data = np.array(data, dtype=np.float32)
+        output = np.array(output)
+
+        if self.workers == 1:
+            for specie in self.species:
+                specie.test(data, output, input_type)
+            return
+
+        # entities are independent, fitness is evaluated in worker processes on pickled copies
+        # every worker gets one batch of untested entities, so their networks are computed in one kernel call
+        entities = [entity for specie in self.species for entity in specie.entities if entity.fitness is None]
+        batch_size = max(1, -(-len(entities) // self.workers))
+        batches = [entities[i:i + batch_size] for i in range(0, len(entities), batch_size)]
+
+        executor = self.get_executor(data, output)
+        batches_scores = executor.map(_eval_entities, batches, repeat(input_type))
+
+        for batch, fitness_scores in zip(batches, batches_scores):
+            for entity, fitness in zip(batch, fitness_scores):
+                entity.fitness = fitness
+
         for specie in self.species:
-            specie.test(data, output, input_type)
+            specie.update_shared_fitness()
+
+    def get_executor(self, data, output):
+        """
+        Returns pool of worker processes holding given data set, pool is started again only when data set changes
+
+        :param data: np.ndarray
+            Input vectors stacked by rows
+        :param output: np.ndarray
+            Expected output vectors stacked by rows
+        :return: ProcessPoolExecutor
+        """
+        if self.executor is not None:
+            old_data, old_output = self.executor_data
+            if np.array_equal(old_data, data) and np.array_equal(old_output, output):
+                return self.executor
+
+            self.close()
+
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(data, output))
+        self.executor_data = (data, output)
+
+        return self.executor
+
+    def close(self):
+        """
+        Shuts down worker processes
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.executor_data = None
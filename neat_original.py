@@ -1,4 +1,3 @@
-import random
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -75,14 +74,20 @@ class NEAT:
         :param suggestion: Specie, optional
             Suggested specie for new entity
         """
-        if suggestion is not None:
-            delta = suggestion.get_genetic_distance(entity, self.distance_c1, self.distance_c2, self.distance_c3)
+        # species with too different numbers of genes are rejected without comparing genes
+        c1, c2, c3 = self.distance_c1, self.distance_c2, self.distance_c3
+
+        if suggestion is not None and suggestion.get_distance_bound(entity, c1, c2) < self.specie_acceptance:
+            delta = suggestion.get_genetic_distance(entity, c1, c2, c3)
             if delta < self.specie_acceptance:
                 suggestion.entities.append(entity)
                 return
 
         for specie in self.species:
-            delta = specie.get_genetic_distance(entity, self.distance_c1, self.distance_c2, self.distance_c3)
+            if specie.get_distance_bound(entity, c1, c2) >= self.specie_acceptance:
+                continue
+
+            delta = specie.get_genetic_distance(entity, c1, c2, c3)
 
             if delta < self.specie_acceptance:
                 specie.entities.append(entity)
@@ -145,7 +150,10 @@ class NEAT:
         for specie in self.species:
             specie.sort()
 
-        self.species.sort(key=lambda s: s.get_best_fitness(), reverse=True)
+        # species by fitness of their best entity, first in sorted scores
+        best_fitness = np.fromiter((s.fitnesses[0] for s in self.species), dtype=np.float64, count=len(self.species))
+        order = np.argsort(-best_fitness, kind='stable')
+        self.species = [self.species[i] for i in order.tolist()]
         self.error_value.append(-self.species[0].get_best_fitness())
 
     def next_generation(self):
@@ -157,8 +165,8 @@ class NEAT:
         self.species = []
 
         # calculate number of offspring base on shared fitness
-        total_shared_fitness = sum([s.shared_fitness for s in old_species])
-        offsprings = [int(round(s.shared_fitness / total_shared_fitness * self.population)) for s in old_species]
+        shared_fitness = np.fromiter((s.shared_fitness for s in old_species), dtype=np.float64, count=len(old_species))
+        offsprings = np.round(shared_fitness / shared_fitness.sum() * self.population).astype(int).tolist()
 
         # pass best entity of every specie unchanged
         # mate species to recreate population
@@ -169,9 +177,17 @@ class NEAT:
                 passed_specie = specie.persist()
                 self.species.append(passed_specie)
                 suggestion = passed_specie
-            mate_probabilities = list(reversed([i + 1 for i in range(len(specie.entities))]))
-            for i in range(offspring):
-                parent1, parent2 = random.choices(specie.entities, mate_probabilities, k=2)
+            if offspring <= 0:
+                continue
+
+            # rank weights, best entity is the most probable, parents of all children are drawn at once
+            cdf = np.cumsum(np.arange(len(specie.entities), 0, -1, dtype=np.float64))
+            cdf /= cdf[-1]
+            parents = np.searchsorted(cdf, np.random.random((offspring, 2)), side='right').tolist()
+
+            for i1, i2 in parents:
+                parent1 = specie.entities[i1]
+                parent2 = specie.entities[i2]
 
                 child = parent1.mate(parent2)
                 self.insert_entity(child, suggestion)
@@ -189,5 +205,8 @@ class NEAT:
         :param output_type: str, optional
             Network output type
         """
+        # expected outputs are stacked once for all entities
+        output = np.array(output)
+
         for specie in self.species:
             specie.test(data, output, input_type, output_type)
@@ -1,48 +1,64 @@
 import numpy as np
+from numba import njit
 
 
 class Network:
     """
     Neural Network
 
-    nodes - list of all network nodes
-    input_nodes - list of input layer nodes, same as in nodes
-    output_nodes - list of output layer nodes, same sa in nodes
+    Nodes are indexed with input nodes first, then output and hidden nodes. Connections are stored in compressed
+    sparse row arrays, one row of incoming connections for every evaluated node, so the forward pass runs
+    in compiled kernel.
+
+    input_num - number of input layer nodes
+    output_ids - array of output layer nodes indices
+    node_order - array of nodes indices in evaluation order, predecessors are evaluated before successors
+    indptr - array of rows boundaries, connections of node_order[k] are in range indptr[k]:indptr[k + 1]
+    indices - array of connections input nodes indices
+    weights - array of connections weights
+    recurrent - array of flags, describing if connection passes value from previous computation
+    sigmoid - array of flags, describing if node uses sigmoid activation function
+    past_values - array of nodes values from previous computation
+
+    Weights and values are single precision, input data is converted on computation
     """
 
     def __init__(self, genotype):
-        self.nodes = []
-        self.input_nodes = []
-        self.output_nodes = []
-
-        # dictionary helps with id : node mapping
-        nodes_dict = dict()
-        # creation of input nodes without activation function
-        for node_id in genotype.input_nodes:
-            node = Node(activation='')
-            self.input_nodes.append(node)
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-        # creation of output nodes without activation function
-        for node_id in genotype.output_nodes:
-            node = Node(activation='')
-            self.output_nodes.append(node)
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-        # creation of hidden nodes with default activation function
-        for node_id in genotype.hidden_nodes:
-            node = Node(activation='sigmoid_custom')
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-
-        # creating connections between nodes
-        for conn in genotype.genes:
-            weight = genotype.genes[conn].weight
-
-            in_id, out_id = conn
-            out_node = nodes_dict[out_id]
-            in_node = nodes_dict[in_id]
-            out_node.predecessors.append((in_node, weight))
+        # input nodes first, then output and hidden nodes
+        node_ids = sorted(genotype.input_nodes) + sorted(genotype.output_nodes) + sorted(genotype.hidden_nodes)
+        indices = {node_id: i for i, node_id in enumerate(node_ids)}
+        nodes_num = len(node_ids)
+
+        self.input_num = len(genotype.input_nodes)
+        hidden_start = self.input_num + len(genotype.output_nodes)
+        self.output_ids = np.arange(self.input_num, hidden_start, dtype=np.int32)
+
+        # hidden nodes with default activation function, input and output nodes without it
+        self.sigmoid = np.zeros(nodes_num, dtype=np.bool_)
+        self.sigmoid[hidden_start:] = True
+
+        # predecessors of every node | index: [(index, weight), ...]
+        # genes keep insertion order, connections don't, order decides which connection of cycle is recurrent
+        predecessors = [[] for _ in range(nodes_num)]
+        weights = genotype.weights.tolist()
+        for (in_id, out_id), index in genotype.genes.items():
+            predecessors[indices[out_id]].append((indices[in_id], weights[index]))
+
+        node_order, indptr, connections = sort_connections(predecessors, self.input_num, self.output_ids.tolist())
+
+        self.node_order = np.array(node_order, dtype=np.int32)
+        self.indptr = np.array(indptr, dtype=np.int32)
+        self.indices = np.array([c[0] for c in connections], dtype=np.int32)
+        self.weights = np.array([c[1] for c in connections], dtype=np.float32)
+        self.recurrent = np.array([c[2] for c in connections], dtype=np.bool_)
+
+        self.past_values = np.zeros(nodes_num, dtype=np.float32)
+
+    def reset(self):
+        """
+        Clears values of previous computation
+        """
+        self.past_values[:] = 0
 
     def compute(self, data, input_type='points', output_type='probability'):
         """
@@ -60,116 +76,254 @@ class Network:
         :return: list
             List of output vectors
         """
-        output = []
+        data = np.asarray(data, dtype=np.float32).reshape(len(data), self.input_num)
 
-        for vector in data:
-            # calculating output for every vector
-            for v, node in zip(vector, self.input_nodes):
-                node.set_value(v)
+        if input_type == 'points':
+            # independent vectors are computed all at once
+            raw_output = forward_batch(data, self.node_order, self.indptr, self.indices, self.weights,
+                                       self.recurrent, self.sigmoid, self.output_ids)
+            self.past_values[:] = 0
+        else:
+            raw_output = forward(data, self.past_values, self.node_order, self.indptr, self.indices, self.weights,
+                                 self.recurrent, self.sigmoid, self.output_ids)
 
-            result = [node.get_value() for node in self.output_nodes]
+        return activate_output(raw_output, output_type)
 
-            result = np.array(result)
-            if output_type == 'probability':
-                if len(result) > 1:
-                    # softmax calculation, multi class probability distribution
-                    x = result
-                    e_x = np.exp(x - np.max(x))
 
-                    result = e_x / e_x.sum()
-                else:
-                    # sigmoid calculation, probability
-                    x = result
-                    x = np.clip(x, -500, 500)
-                    result = 1 / (1 + np.exp(-x))
+def activate_output(raw_output, output_type):
+    """
+    Converts raw network output to requested output type
+
+    :param raw_output: np.ndarray
+        Raw output vectors stacked by rows
+    :param output_type: str
+        Type of output
+    :return: list
+        List of output vectors
+    """
+    result = np.asarray(raw_output)
 
-            output.append(result)
+    if output_type == 'probability' and len(result) > 0:
+        if result.shape[1] > 1:
+            # softmax calculation, multi class probability distribution, every row at once
+            e_x = np.exp(result - result.max(axis=1, keepdims=True))
 
-            # reset nodes
-            for node in self.nodes:
-                node.reset()
-                if input_type == 'points':
-                    node.past_value = 0
+            result = e_x / e_x.sum(axis=1, keepdims=True)
+        else:
+            # sigmoid calculation, probability, clipped to range of single precision exponent
+            result = 1 / (1 + np.exp(-np.clip(result, -88, 88)))
 
-        return output
+    return list(result)
 
 
-class Node:
+def compute_networks(networks, data, output_type='probability'):
     """
-    Single node of neural network
+    Computes the forward pass of several networks for every independent input vector at once
 
-    value - value of node
-    activation - activation function of node
-    visited - flag, describing if node was visited and value can be simply passed
-    predecessors - list of tuples (node, weight) from which values are combined
+    Networks are joined into one graph, input nodes of all networks are placed first, then other nodes network
+    after network, so all networks are evaluated in one call of compiled kernel, recurrent connections pass no value.
+
+    :param networks: list
+        List of networks with the same input and output layers
+    :param data: list
+        List of input vectors
+    :param output_type: str, optional
+        Type of output
+    :return: list
+        List of output vectors lists, one for every network
     """
+    networks_num = len(networks)
+    input_num = networks[0].input_num
+    output_num = networks[0].output_ids.shape[0]
 
-    def __init__(self, activation='sigmoid_custom'):
-        self.value = 0
-        self.past_value = 0
-        self.visited = False
-        self.calculated = False
-        self.predecessors = []
+    data = np.asarray(data, dtype=np.float32).reshape(len(data), input_num)
 
-        activations = {'ReLU': self.activation_ReLU,
-                       'sigmoid_custom': self.activation_sigmoid_custom}
-        self.activation = activations[activation] if activation in activations else None
+    node_orders = []
+    indptrs = [np.zeros(1, dtype=np.int32)]
+    indices = []
+    sigmoids = []
+    remaps = []
 
-    def activation_ReLU(self):
-        """
-        Executes ReLU function on node's value
-        """
-        self.value = max(0, self.value)
+    nodes_start = networks_num * input_num
+    connections_start = 0
+    for i, network in enumerate(networks):
+        nodes_num = network.sigmoid.shape[0]
 
-    def activation_sigmoid_custom(self):
-        """
-        Executes sigmoid function on node's value
-        """
-        self.value = 1 / (1 + np.e ** (-4.9 * self.value))
+        # positions of network nodes in joined graph
+        remap = np.empty(nodes_num, dtype=np.int32)
+        remap[:input_num] = np.arange(i * input_num, (i + 1) * input_num)
+        remap[input_num:] = np.arange(nodes_start, nodes_start + nodes_num - input_num)
 
-    def get_value(self):
-        """
-        Computes and returns value of the node, if node was visited previously and calculation isn't finished
-        returns value of previous computation, acting like recurrent connection
-        """
-        if not self.visited:
-            # first visit at node
-            self.visited = True
+        node_orders.append(remap[network.node_order])
+        indptrs.append(network.indptr[1:] + connections_start)
+        indices.append(remap[network.indices])
+        sigmoids.append(network.sigmoid[input_num:])
+        remaps.append(remap)
 
-            # value calculation
-            for node, weight in self.predecessors:
-                self.value += (node.get_value() * weight)
+        nodes_start += nodes_num - input_num
+        connections_start += network.indices.shape[0]
 
-            # applying activation function
-            if self.activation is not None:
-                self.activation()
+    sigmoid = np.concatenate([np.zeros(networks_num * input_num, dtype=np.bool_)] + sigmoids)
+    output_ids = np.concatenate([remap[network.output_ids] for remap, network in zip(remaps, networks)])
 
-            self.calculated = True
+    raw_output = forward_batch(np.tile(data, (1, networks_num)), np.concatenate(node_orders), np.concatenate(indptrs),
+                               np.concatenate(indices), np.concatenate([network.weights for network in networks]),
+                               np.concatenate([network.recurrent for network in networks]), sigmoid, output_ids)
 
-            return self.value
-        else:
-            # visited node
-            if self.calculated:
-                # calculated in this computation
-                return self.value
+    # vector, network, output -> network, vector, output
+    raw_outputs = raw_output.reshape(data.shape[0], networks_num, output_num).transpose(1, 0, 2)
+
+    return [activate_output(raw_output, output_type) for raw_output in raw_outputs]
+
+
+def sort_connections(predecessors, input_num, output_ids):
+    """
+    Orders nodes and connections for evaluation with depth first search from output nodes
+
+    Node is evaluated after all of its predecessors, connection from node which evaluation isn't finished yet
+    (cycle in network) is marked as recurrent and passes value of previous computation.
+    Nodes not connected to outputs are skipped.
+
+    :param predecessors: list
+        List of predecessors for every node | [[(index, weight), ...], ...]
+    :param input_num: int
+        Number of input layer nodes, indexed first
+    :param output_ids: list
+        Indices of output layer nodes
+    :return: tuple
+        List of nodes indices in evaluation order, list of rows boundaries and list of connections
+        (in, weight, recurrent) grouped by output node in the same order
+    """
+    node_order = []
+    indptr = [0]
+    connections = []
+
+    # 0 - not visited, 1 - visited and evaluation isn't finished, 2 - evaluated
+    state = [0] * len(predecessors)
+    # connections of nodes in evaluation
+    pending = [[] for _ in predecessors]
+
+    for output_id in output_ids:
+        if state[output_id] != 0:
+            continue
+
+        state[output_id] = 1
+        stack = [[output_id, 0]]
+
+        while stack:
+            frame = stack[-1]
+            node, position = frame
+
+            if position < len(predecessors[node]):
+                frame[1] += 1
+                in_node, weight = predecessors[node][position]
+
+                # predecessor in evaluation acts like recurrent connection
+                pending[node].append((in_node, weight, state[in_node] == 1))
+
+                if state[in_node] == 0:
+                    # predecessor is evaluated first
+                    state[in_node] = 1
+                    stack.append([in_node, 0])
             else:
-                # recurrent connection
-                return self.past_value
+                stack.pop()
+                state[node] = 2
 
-    def set_value(self, new_val):
-        """
-        Sets node's value
+                # input nodes values are given
+                if node >= input_num:
+                    node_order.append(node)
+                    connections.extend(pending[node])
+                    indptr.append(len(connections))
 
-        :param new_val: double
-            New node's value
-        """
-        self.value = new_val
+    return node_order, indptr, connections
 
-    def reset(self):
-        """
-        Resets node visit flag and value
-        """
-        self.visited = False
-        self.calculated = False
-        self.past_value = self.value
-        self.value = 0
+
+@njit(cache=True)
+def forward(data, past_values, node_order, indptr, indices, weights, recurrent, sigmoid, output_ids):
+    """
+    Computes raw network output for sequence of input vectors, nodes values are passed to next vector
+
+    :param data: np.ndarray
+        Input vectors stacked by rows
+    :param past_values: np.ndarray
+        Values of nodes from previous computation, updated in place
+    :return: np.ndarray
+        Output vectors stacked by rows
+    """
+    samples_num, input_num = data.shape
+
+    output = np.empty((samples_num, output_ids.shape[0]), dtype=np.float32)
+    values = np.zeros(past_values.shape[0], dtype=np.float32)
+
+    for p in range(samples_num):
+        values[:] = 0
+        values[:input_num] = data[p]
+
+        for k in range(node_order.shape[0]):
+            node = node_order[k]
+
+            # weighted sum of node's connections
+            value = 0.
+            for m in range(indptr[k], indptr[k + 1]):
+                if recurrent[m]:
+                    value += past_values[indices[m]] * weights[m]
+                else:
+                    value += values[indices[m]] * weights[m]
+
+            if sigmoid[node]:
+                value = 1 / (1 + np.exp(-4.9 * value))
+
+            values[node] = value
+
+        for o in range(output_ids.shape[0]):
+            output[p, o] = values[output_ids[o]]
+
+        past_values[:] = values
+
+    return output
+
+
+@njit(cache=True)
+def forward_batch(data, node_order, indptr, indices, weights, recurrent, sigmoid, output_ids):
+    """
+    Computes raw network output for all independent input vectors at once, recurrent connections pass no value
+
+    Nodes values are stored by rows, one column for every input vector
+
+    :param data: np.ndarray
+        Input vectors stacked by rows
+    :return: np.ndarray
+        Output vectors stacked by rows
+    """
+    samples_num, input_num = data.shape
+
+    values = np.zeros((sigmoid.shape[0], samples_num), dtype=np.float32)
+    values[:input_num] = data.T
+    # sums are accumulated in double precision, only node values are stored as floats
+    sums = np.empty(samples_num, dtype=np.float64)
+
+    for k in range(node_order.shape[0]):
+        node = node_order[k]
+
+        # weighted sum of node's connections for every vector
+        sums[:] = 0
+        for m in range(indptr[k], indptr[k + 1]):
+            if not recurrent[m]:
+                in_values = values[indices[m]]
+                weight = weights[m]
+                for p in range(samples_num):
+                    sums[p] += in_values[p] * weight
+
+        node_values = values[node]
+        if sigmoid[node]:
+            for p in range(samples_num):
+                node_values[p] = 1 / (1 + np.exp(-4.9 * sums[p]))
+        else:
+            for p in range(samples_num):
+                node_values[p] += sums[p]
+
+    output = np.empty((samples_num, output_ids.shape[0]), dtype=np.float32)
+    for o in range(output_ids.shape[0]):
+        output[:, o] = values[output_ids[o]]
+
+    return output
@@ -1,49 +1,204 @@
+import math
+
 import numpy as np
+from scipy import sparse
+
+# steepness of custom sigmoid (from paper)
+_SIGMOID_K = -4.9
 
 
 class Network:
     """
     Neural Network
 
-    nodes - list of all network nodes
-    input_nodes - list of input layer nodes, same as in nodes
-    output_nodes - list of output layer nodes, same sa in nodes
+    Nodes are indexed with input nodes first, then output and hidden nodes. Connections are stored in compressed
+    sparse row arrays, one row of incoming connections for every evaluated node.
+
+    input_num - number of input layer nodes
+    output_ids - array of output layer nodes indices
+    sigmoid - array of flags, describing if node uses sigmoid activation function
+    node_order - list of nodes indices in evaluation order, predecessors are evaluated before successors
+    indptr - list of rows boundaries, connections of node_order[k] are in range indptr[k]:indptr[k + 1]
+    indices - array of connections input values indices, recurrent connections point to past values
+    weights - array of connections weights
+    state - array of nodes values followed by nodes values from previous computation
+    values - view of state with nodes values
+    past_values - view of state with nodes values from previous computation
+    depths - array of nodes depths, length of the longest path of not recurrent connections from inputs
+    depth - depth of the deepest node
+    matrix - sparse weights matrix of not recurrent connections | rows - output nodes, columns - input nodes
+    layers - list of sparse weights matrices for every layer of nodes, split from matrix on first use
+    layers_nodes - list of nodes indices in every layer
+    layers_sigmoid - list of flags for every layer, describing if node uses sigmoid activation function
+
+    Matrix and layers are used for independent input vectors, every node is in one layer deeper than its predecessors,
+    connections closing cycles are skipped as they pass no value
     """
 
     def __init__(self, genotype):
-        self.nodes = []
-        self.input_nodes = []
-        self.output_nodes = []
-
-        # dictionary helps with id : node mapping
-        nodes_dict = dict()
-        # creation of input nodes without activation function
-        for node_id in genotype.input_nodes:
-            node = Node(activation='')
-            self.input_nodes.append(node)
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-        # creation of output nodes without activation function
-        for node_id in genotype.output_nodes:
-            node = Node(activation='')
-            self.output_nodes.append(node)
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-        # creation of hidden nodes with default activation function
-        for node_id in genotype.hidden_nodes:
-            node = Node(activation='sigmoid_custom')
-            self.nodes.append(node)
-            nodes_dict[node_id] = node
-
-        # creating connections between nodes
+        # input nodes first, then output and hidden nodes
+        node_ids = list(genotype.input_nodes) + list(genotype.output_nodes) + list(genotype.hidden_nodes)
+        node_indices = {node_id: i for i, node_id in enumerate(node_ids)}
+        nodes_num = len(node_ids)
+
+        self.input_num = len(genotype.input_nodes)
+        hidden_start = self.input_num + len(genotype.output_nodes)
+        self.output_ids = np.arange(self.input_num, hidden_start)
+
+        # hidden nodes with default activation function, input and output nodes without it
+        self.sigmoid = np.zeros(nodes_num, dtype=np.bool_)
+        self.sigmoid[hidden_start:] = True
+
+        # predecessors of every node | index: [(index, weight), ...]
+        predecessors = [[] for _ in range(nodes_num)]
         for conn in genotype.genes:
             if genotype.genes[conn].active:
                 weight = genotype.genes[conn].weight
 
                 in_id, out_id = conn
-                out_node = nodes_dict[out_id]
-                in_node = nodes_dict[in_id]
-                out_node.predecessors.append((in_node, weight))
+                predecessors[node_indices[out_id]].append((node_indices[in_id], weight))
+
+        node_order, connections = sort_nodes(predecessors, self.input_num, self.output_ids.tolist())
+
+        self.node_order = node_order
+        self.indptr = [0]
+        indices = []
+        weights = []
+        for node in node_order:
+            for in_node, weight, recurrent in connections[node]:
+                # past values are placed after current values
+                indices.append(in_node + nodes_num if recurrent else in_node)
+                weights.append(weight)
+            self.indptr.append(len(indices))
+        self.indices = np.array(indices, dtype=np.intp)
+        self.weights = np.array(weights, dtype=np.float64)
+
+        self.state = np.zeros(2 * nodes_num)
+        self.values = self.state[:nodes_num]
+        self.past_values = self.state[nodes_num:]
+
+        # inputs are on depth 0, every evaluated node is one step deeper than its deepest predecessor
+        depths = [0] * nodes_num
+        for node in node_order:
+            depths[node] = 1 + max((depths[i] for i, _, recurrent in connections[node] if not recurrent), default=0)
+        self.depths = np.array(depths)
+        self.depth = max(depths)
+
+        # compressed sparse rows of not recurrent connections, row for every node
+        matrix_indptr = [0]
+        matrix_indices = []
+        matrix_weights = []
+        for node in range(nodes_num):
+            for in_node, weight, recurrent in connections[node]:
+                if not recurrent:
+                    matrix_indices.append(in_node)
+                    matrix_weights.append(weight)
+            matrix_indptr.append(len(matrix_indices))
+
+        self.matrix = sparse.csr_matrix((np.array(matrix_weights, dtype=np.float64),
+                                         np.array(matrix_indices, dtype=np.int32),
+                                         np.array(matrix_indptr, dtype=np.int32)), shape=(nodes_num, nodes_num))
+
+        self.layers = None
+        self.layers_nodes = None
+        self.layers_sigmoid = None
+
+    def create_layers(self):
+        """
+        Splits weights matrix into layers, rows of nodes on the same depth are copied into separate matrix
+        """
+        nodes_num = self.sigmoid.shape[0]
+        matrix_indptr = self.matrix.indptr
+        row_lengths = np.diff(matrix_indptr)
+
+        self.layers = []
+        self.layers_nodes = []
+        self.layers_sigmoid = []
+        for depth in range(1, self.depth + 1):
+            layer_nodes = np.flatnonzero(self.depths == depth)
+
+            # positions of layer nodes connections in matrix arrays
+            positions = np.concatenate([np.arange(matrix_indptr[node], matrix_indptr[node + 1])
+                                        for node in layer_nodes.tolist()])
+            indptr = np.zeros(layer_nodes.shape[0] + 1, dtype=np.int32)
+            np.cumsum(row_lengths[layer_nodes], out=indptr[1:])
+
+            layer = sparse.csr_matrix((self.matrix.data[positions], self.matrix.indices[positions], indptr),
+                                      shape=(layer_nodes.shape[0], nodes_num))
+
+            self.layers.append(layer)
+            self.layers_nodes.append(layer_nodes)
+            self.layers_sigmoid.append(self.sigmoid[layer_nodes])
+
+    def reset(self):
+        """
+        Clears values of previous computation
+        """
+        self.state[:] = 0
+
+    def compute_layers(self, data):
+        """
+        Computes raw network output for all independent input vectors at once, layer by layer
+
+        :param data: list
+            List of input vectors
+        :return: np.ndarray
+            Output vectors stacked by rows
+        """
+        data = np.asarray(data, dtype=np.float64).reshape(len(data), self.input_num)
+
+        # nodes values by rows, one column for every vector
+        values = np.zeros((self.sigmoid.shape[0], data.shape[0]))
+        values[:self.input_num] = data.T
+
+        if self.layers is None:
+            self.create_layers()
+
+        for weights, layer_nodes, sigmoid in zip(self.layers, self.layers_nodes, self.layers_sigmoid):
+            z = weights @ values
+            z[sigmoid] = 1 / (1 + np.exp(_SIGMOID_K * z[sigmoid]))
+
+            values[layer_nodes] = z
+
+        return values[self.output_ids].T
+
+    def compute_sequence(self, data):
+        """
+        Computes raw network output for sequence of input vectors, nodes values are passed to next vector
+
+        :param data: list
+            List of input vectors
+        :return: list
+            List of output vectors
+        """
+        state = self.state
+        values = self.values
+        indices = self.indices
+        weights = self.weights
+        indptr = self.indptr
+        sigmoid = self.sigmoid
+
+        raw_output = []
+        for vector in data:
+            # calculating output for every vector
+            values[:self.input_num] = vector
+
+            for k, node in enumerate(self.node_order):
+                start, end = indptr[k], indptr[k + 1]
+                value = float(state[indices[start:end]] @ weights[start:end])
+
+                if sigmoid[node]:
+                    value = 1. / (1. + math.exp(min(_SIGMOID_K * value, 500.)))
+
+                values[node] = value
+
+            raw_output.append(values[self.output_ids])
+
+            # values are passed to next vector
+            self.past_values[:] = values
+            values[:] = 0
+
+        return raw_output
 
     def compute(self, data, input_type='points', output_type='probability'):
         """
@@ -61,123 +216,139 @@ class Network:
         :return: list
             List of output vectors
         """
-        output = []
+        if input_type == 'points':
+            # independent vectors are computed all at once
+            raw_output = self.compute_layers(data)
+            self.past_values[:] = 0
+        else:
+            raw_output = self.compute_sequence(data)
 
-        for vector in data:
-            # calculating output for every vector
-            for v, node in zip(vector, self.input_nodes):
-                node.set_value(v)
+        return activate_output(raw_output, output_type)
 
-            result = [node.get_value() for node in self.output_nodes]
 
-            result = np.array(result)
-            if output_type == 'probability':
-                if len(result) > 1:
-                    # softmax calculation, multi class probability distribution
-                    x = result
-                    e_x = np.exp(x - np.max(x))
+def activate_output(raw_output, output_type):
+    """
+    Converts raw network output to requested output type
 
-                    result = e_x / e_x.sum()
-                else:
-                    # sigmoid calculation, probability
-                    x = result
-                    x = np.clip(x, -500, 500)
-                    result = 1 / (1 + np.exp(-x))
+    :param raw_output: list or np.ndarray
+        Raw output vectors
+    :param output_type: str
+        Type of output
+    :return: list
+        List of output vectors
+    """
+    result = np.asarray(raw_output)
 
-            output.append(result)
+    if output_type == 'probability' and len(result) > 0:
+        if result.shape[1] > 1:
+            # softmax calculation, multi class probability distribution, every row at once
+            e_x = np.exp(result - result.max(axis=1, keepdims=True))
 
-            # reset nodes
-            for node in self.nodes:
-                node.reset()
-                if input_type == 'points':
-                    node.past_value = 0
+            result = e_x / e_x.sum(axis=1, keepdims=True)
+        else:
+            # sigmoid calculation, probability
+            result = 1 / (1 + np.exp(-np.clip(result, -500, 500)))
 
-        return output
+    return list(result)
 
 
-class Node:
+def compute_networks(networks, data, output_type='probability'):
     """
-    Single node of neural network
+    Computes the forward pass of several networks for every independent input vector at once
 
-    value - value of node
-    activation - activation function of node
-    visited - flag, describing if node was visited and value can be simply passed
-    predecessors - list of tuples (node, weight) from which values are combined
+    Weights matrices of all networks are joined into one block diagonal sparse matrix, all nodes are updated together
+    until the deepest network is evaluated, recurrent connections pass no value.
+
+    :param networks: list
+        List of networks with the same input and output layers
+    :param data: list
+        List of input vectors
+    :param output_type: str, optional
+        Type of output
+    :return: list
+        List of output vectors lists, one for every network
     """
+    networks_num = len(networks)
+    input_num = networks[0].input_num
+    output_num = networks[0].output_ids.shape[0]
 
-    def __init__(self, activation='sigmoid_custom'):
-        self.value = 0
-        self.past_value = 0
-        self.visited = False
-        self.calculated = False
-        self.predecessors = []
+    data = np.asarray(data, dtype=np.float64).reshape(len(data), input_num)
 
-        activations = {'ReLU': self.activation_ReLU,
-                       'sigmoid_custom': self.activation_sigmoid_custom,
-                       'sigmoid': self.activation_sigmoid}
-        self.activation = activations[activation] if activation in activations else None
+    weights = sparse.block_diag([network.matrix for network in networks], format='csr')
+    sigmoid = np.concatenate([network.sigmoid for network in networks])
 
-    def activation_ReLU(self):
-        """
-        Executes ReLU function on node's value
-        """
-        self.value = max(0, self.value)
+    # networks nodes are placed one after another
+    offsets = np.cumsum([0] + [network.sigmoid.shape[0] for network in networks[:-1]])
+    input_ids = (offsets[:, None] + np.arange(input_num)).ravel()
+    output_ids = (offsets[:, None] + networks[0].output_ids).ravel()
 
-    def activation_sigmoid(self):
-        """
-        Executes sigmoid function on node's value
-        """
-        self.value = 1 / (1 + np.e ** (-self.value))
+    # nodes values by rows, one column for every vector
+    inputs = np.tile(data.T, (networks_num, 1))
+    values = np.zeros((sigmoid.shape[0], data.shape[0]))
+    values[input_ids] = inputs
 
-    def activation_sigmoid_custom(self):
-        """
-        Executes custom sigmoid (from paper) function on node's value
-        """
-        self.value = 1 / (1 + np.e ** (-4.9 * self.value))
+    # after k steps all nodes on depth k are evaluated
+    for _ in range(max(network.depth for network in networks)):
+        values = weights @ values
+        values[sigmoid] = 1 / (1 + np.exp(_SIGMOID_K * values[sigmoid]))
+        values[input_ids] = inputs
 
-    def get_value(self):
-        """
-        Computes and returns value of the node, if node was visited previously and calculation isn't finished
-        returns value of previous computation, acting like recurrent connection
-        """
-        if not self.visited:
-            # first visit at node
-            self.visited = True
+    raw_outputs = values[output_ids].reshape(networks_num, output_num, data.shape[0]).transpose(0, 2, 1)
 
-            # value calculation
-            for node, weight in self.predecessors:
-                self.value += (node.get_value() * weight)
+    return [activate_output(raw_output, output_type) for raw_output in raw_outputs]
 
-            # applying activation function
-            if self.activation is not None:
-                self.activation()
 
-            self.calculated = True
+def sort_nodes(predecessors, input_num, output_ids):
+    """
+    Orders nodes for evaluation with depth first search from output nodes, like recursive computation
 
-            return self.value
-        else:
-            # visited node
-            if self.calculated:
-                # calculated in this computation
-                return self.value
-            else:
-                # recurrent connection
-                return self.past_value
+    Node is evaluated after all of its predecessors, connection from node which evaluation isn't finished yet
+    (cycle in network) is marked as recurrent and passes value of previous computation.
+    Nodes not connected to outputs are skipped.
 
-    def set_value(self, new_val):
-        """
-        Sets node's value
+    :param predecessors: list
+        List of predecessors for every node | [[(index, weight), ...], ...]
+    :param input_num: int
+        Number of input layer nodes, indexed first
+    :param output_ids: list
+        Indices of output layer nodes
+    :return: tuple
+        List of nodes indices in evaluation order and list of connections (in, weight, recurrent) for every node
+    """
+    node_order = []
+    connections = [[] for _ in predecessors]
 
-        :param new_val: double
-            New node's value
-        """
-        self.value = new_val
+    # 0 - not visited, 1 - visited and evaluation isn't finished, 2 - evaluated
+    state = [0] * len(predecessors)
 
-    def reset(self):
-        """
-        Resets node visit flag and value
-        """
-        self.visited = False
-        self.calculated = False
-        self.past_value = self.value
-        self.value = 0
+    for output_id in output_ids:
+        if state[output_id] != 0:
+            continue
+
+        state[output_id] = 1
+        stack = [[output_id, 0]]
+
+        while stack:
+            frame = stack[-1]
+            node, position = frame
+
+            if position < len(predecessors[node]):
+                frame[1] += 1
+                in_node, weight = predecessors[node][position]
+
+                # predecessor in evaluation acts like recurrent connection
+                connections[node].append((in_node, weight, state[in_node] == 1))
+
+                if state[in_node] == 0:
+                    # predecessor is evaluated first
+                    state[in_node] = 1
+                    stack.append([in_node, 0])
+            else:
+                stack.pop()
+                state[node] = 2
+
+                # input nodes values are given
+                if node >= input_num:
+                    node_order.append(node)
+
+    return node_order, connections
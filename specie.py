@@ -1,4 +1,7 @@
-from genetics import Gene
+import numpy as np
+from numba import njit
+
+from network import compute_networks
 
 
 class Specie:
@@ -6,9 +9,10 @@ class Specie:
     Specie of networks with similar genetic marker
 
     entities - list of specie entities
-    marker - specie base genetic marker
+    fitnesses - array of entities fitness scores, in entities order from last update of shared fitness
 
-    Marker is created from first entity in specie
+    Genetic marker of specie is taken from its first entity, sorted markers are cached by the entity,
+    so the newest marker is the last one
     """
 
     def __init__(self, entity):
@@ -17,13 +21,19 @@ class Specie:
             First specie entity
         """
         self.entities = [entity]
+        self.fitnesses = None
         self.shared_fitness = 0
 
     def sort(self):
         """
-        Sorts entities by their fitness score
+        Sorts entities by their fitness score, scores are collected again before every sort
         """
-        self.entities.sort(key=lambda e: e.fitness, reverse=True)
+        self.update_shared_fitness()
+
+        # descending order, equal scores keep their order
+        order = np.argsort(-self.fitnesses, kind='stable')
+        self.entities = [self.entities[i] for i in order.tolist()]
+        self.fitnesses = self.fitnesses[order]
 
     def get_best_fitness(self):
         """
@@ -33,6 +43,31 @@ class Specie:
         """
         return self.entities[0].fitness
 
+    def get_distance_bound(self, entity, c1, c2):
+        """
+        Calculates lower bound of genetic distance between specie and given entity from numbers of genes only
+
+        Every gene of bigger genotype without pair is excess or disjoint gene, so difference of genes numbers
+        weighted with smaller of c1, c2 never exceeds genetic distance
+
+        :param entity: Entity
+            Entity for which bound will be calculated
+        :param c1: double
+            Weight of excess genes
+        :param c2: double
+            Weight of disjoint genes
+        :return: double
+            Lower bound of distance
+        """
+        genes_num1 = len(self.entities[0].genotype.genes)
+        genes_num2 = len(entity.genotype.genes)
+
+        normalization_factor = max(genes_num1, genes_num2)
+        if normalization_factor < 20:
+            normalization_factor = 1
+
+        return min(c1, c2) * abs(genes_num1 - genes_num2) / normalization_factor
+
     def get_genetic_distance(self, entity, c1, c2, c3):
         """
         Calculates genetic distance between specie (best entity in specie) and given entity
@@ -58,66 +93,14 @@ class Specie:
         :return: double
             Distance value
         """
+        markers1, weights1 = self.entities[0].get_markers()
+        markers2, weights2 = entity.get_markers()
 
-        # genes of both entities
-        genes1 = self.entities[0].genotype.genes
-        genes2 = entity.genotype.genes
-
-        # full genetic information for historical markers
-        genetics = Gene.genetics
-
-        # historical markers for every gene
-        markers_conns2 = {(next(iter(genetics[g])), g) for g in genes2}
-        markers1 = {next(iter(genetics[g])) for g in genes1}
-        markers2 = {t[0] for t in markers_conns2}
-
-        # newest gene of specie entity, marks line between disjoint and excess genes
-        if len(markers1) == 0:
-            max_base_marker = 0
-        else:
-            max_base_marker = max(markers1)
-
-        normalization_factor = max(len(markers1), len(markers2))
-        if normalization_factor < 20:
-            normalization_factor = 1
-
-        # counters
-        excess_num = 0
-        disjoint_num = 0
-        weight_dif = 0
-        match_num = 0
-
-        for m, c in markers_conns2:
-            if m not in markers1:
-                if m > max_base_marker:
-                    # excess gene in entity 2
-                    excess_num += 1
-                else:
-                    # disjoint gene in entity 2
-                    disjoint_num += 1
-            else:
-                # matching gene
-                match_num += 1
-                w1 = genes1[c].weight
-                w2 = genes2[c].weight
-
-                diff = abs(w1 - w2)
-                weight_dif += diff
-        for m in markers1:
-            if m not in markers2:
-                # disjoint gene in entity 1
-                disjoint_num += 1
-
-        ex = excess_num
-        di = disjoint_num
-        we = weight_dif / match_num if match_num > 0 else 0
-        n = normalization_factor
-
-        return c1 * ex / n + c2 * di / n + c3 * we
+        return genetic_distance(markers1, weights1, markers2, weights2, c1, c2, c3)
 
     def test(self, data, output, input_type='points'):
         """
-        Test every entity in specie
+        Test every entity in specie, entities with known fitness score are skipped
 
         :param data: list
             List of input vectors
@@ -126,12 +109,108 @@ class Specie:
         :param input_type:
             Network input type
         """
-        self.shared_fitness = 0
-        specie_size = len(self.entities)
+        # best entities passed unchanged keep their scores
+        test_entities([entity for entity in self.entities if entity.fitness is None], data, output, input_type)
+
+        self.update_shared_fitness()
+
+    def update_shared_fitness(self):
+        """
+        Calculates shared fitness from fitness scores of already tested entities
+        """
+        self.fitnesses = np.fromiter((entity.fitness for entity in self.entities), dtype=np.float64,
+                                     count=len(self.entities))
+        self.shared_fitness = float(self.fitnesses.mean())
 
-        for entity in self.entities:
+
+def test_entities(entities, data, output, input_type='points'):
+    """
+    Calculates fitness score of every given entity
+
+    :param entities: list
+        List of entities to test
+    :param data: np.ndarray
+        Input vectors stacked by rows
+    :param output: np.ndarray
+        Expected output vectors stacked by rows
+    :param input_type: str, optional
+        Network input type
+    """
+    if input_type == 'points':
+        # independent vectors allow to compute all networks at once
+        if len(entities) > 0:
+            networks = [entity.create_network() for entity in entities]
+
+            for entity, net_out in zip(entities, compute_networks(networks, data)):
+                entity.score(net_out, output)
+    else:
+        for entity in entities:
             entity.test(data, output, input_type)
 
-            self.shared_fitness += entity.fitness
 
-        self.shared_fitness /= specie_size
+@njit(cache=True)
+def genetic_distance(markers1, weights1, markers2, weights2, c1, c2, c3):
+    """
+    Calculates genetic distance between two genotypes, genes are compared in one pass like in merge of sorted lists
+
+    :param markers1: np.ndarray
+        Sorted historical markers of base genotype
+    :param weights1: np.ndarray
+        Weights of base genotype genes in markers order
+    :param markers2: np.ndarray
+        Sorted historical markers of compared genotype
+    :param weights2: np.ndarray
+        Weights of compared genotype genes in markers order
+    :return: double
+        Distance value
+    """
+    num1 = markers1.shape[0]
+    num2 = markers2.shape[0]
+
+    # newest gene of specie entity, marks line between disjoint and excess genes, last of sorted markers
+    max_base_marker = markers1[num1 - 1] if num1 > 0 else 0
+
+    normalization_factor = max(num1, num2)
+    if normalization_factor < 20:
+        normalization_factor = 1
+
+    # counters
+    excess_num = 0
+    disjoint_num = 0
+    match_num = 0
+    weight_dif = 0.
+
+    i = 0
+    j = 0
+    while i < num1 and j < num2:
+        if markers1[i] == markers2[j]:
+            # matching gene
+            match_num += 1
+            weight_dif += abs(weights1[i] - weights2[j])
+            i += 1
+            j += 1
+        elif markers1[i] < markers2[j]:
+            # disjoint gene in entity 1
+            disjoint_num += 1
+            i += 1
+        else:
+            # gene in entity 2 older than newest gene of entity 1
+            if markers2[j] > max_base_marker:
+                excess_num += 1
+            else:
+                disjoint_num += 1
+            j += 1
+
+    # remaining genes of entity 1 are disjoint, remaining genes of entity 2 are newer than all genes of entity 1,
+    # except gene with marker 0 compared to empty entity 1
+    disjoint_num += num1 - i
+    while j < num2:
+        if markers2[j] > max_base_marker:
+            excess_num += 1
+        else:
+            disjoint_num += 1
+        j += 1
+
+    we = weight_dif / match_num if match_num > 0 else 0.
+
+    return c1 * excess_num / normalization_factor + c2 * disjoint_num / normalization_factor + c3 * we